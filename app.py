@@ -9,103 +9,242 @@ eventlet.monkey_patch()
 
 from flask import Flask, render_template, request
 from flask_socketio import SocketIO, emit
+import orjson
 import threading 
 import time
 import re 
 import os
-from datetime import datetime, timedelta 
+import logging
+import collections
+import functools
+import itertools
 
 # --- Flask & SocketIO Setup ---
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a-secure-random-string') 
+# Status output goes through logging at DEBUG so production skips the formatting and stdio writes
+log = logging.getLogger(__name__)
+
+class OrjsonCodec:
+    """Stdlib-compatible json shim so every Socket.IO packet is encoded with orjson."""
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        # orjson output is already compact; stdlib options such as separators are ignored
+        return orjson.dumps(obj).decode('utf-8')
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
 # Explicitly use async_mode='eventlet'
-socketio = SocketIO(app, async_mode='eventlet') 
+socketio = SocketIO(app, async_mode='eventlet', json=OrjsonCodec) 
 
 # --- Global Configuration & Data Structures ---
 HISTORY_RETENTION_SECONDS = 2 * 60 * 60 
 PURGE_INTERVAL_SECONDS = 5 * 60 
+# Hard cap on stored messages; the time-based purge still enforces retention below this
+HISTORY_MAX_MESSAGES = 10_000
 PERSISTENCE_TIMEOUT_SECONDS = 60 
+TYPISTS_BROADCAST_DELAY_SECONDS = 0.1
+USER_COUNT_BROADCAST_DELAY_SECONDS = 0.25
 
 # ⭐️ FIX: Global flag to ensure the purge loop is started once per worker process
 background_task_started = False
 
 user_aliases = {} 
-current_anon_id = 0
-alias_lock = threading.Lock()
-temporary_sessions = {}
+sid_lock = threading.Lock()
+# Pending coalesced 'user_count' broadcast, if one is scheduled
+user_count_timer = None
+user_count_timer_lock = threading.Lock()
+# next() on itertools.count is atomic, so new aliases need no lock
+anon_id_counter = itertools.count(1)
+sessions_lock = threading.Lock()
+# Insertion order matches expiry order, so expired reservations sit at the front
+temporary_sessions = collections.OrderedDict()
+# Keyed by sid; aliases are resolved only when the typists list is broadcast
 typing_users = set()
 typing_lock = threading.Lock()
-chat_history = []
+# Pending coalesced 'typists' broadcast, if one is scheduled
+typists_timer = None
+typists_timer_lock = threading.Lock()
+# History entries are compact tuples rather than per-message dicts; `json` caches the
+# serialized [alias, msg] pair so history snapshots never re-encode old messages
+Msg = collections.namedtuple('Msg', 'alias msg ts json')
+chat_history = collections.deque(maxlen=HISTORY_MAX_MESSAGES)
 history_lock = threading.Lock()
 
+# Reusable outbound payload dicts for 'message' broadcasts
+MSG_POOL_SIZE = 1024
+_msg_pool = collections.deque(maxlen=MSG_POOL_SIZE)
+
 # --- CENSORSHIP LOGIC ---
 BAD_WORDS = ['hate', 'harass', 'slur', 'offensive', 'fuck', 'shit', 'ass', 'bastard', 'bitch', 'cock', 'dick', 'whore', 'sex'] 
 
+def _trie_pattern(words):
+    """Builds a prefix-trie regex so each position branches on one character, not every word."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word.lower():
+            node = node.setdefault(ch, {})
+        node[''] = {}
+
+    def render(node):
+        alternatives = [re.escape(ch) + render(child) for ch, child in sorted(node.items()) if ch]
+        if not alternatives:
+            return ''
+        optional = '' in node
+        if len(alternatives) == 1 and not optional:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')' + ('?' if optional else '')
+
+    return render(trie)
+
+@functools.lru_cache(maxsize=4)
+def _compile_censor(words):
+    """Compiles the censor patterns, prefilter table and replacements for a frozenset of words.
+
+    Cached so a reloaded word list is compiled once, however many threads ask for it.
+    ASCII messages are lowercased up front and scanned case-sensitively, which SRE matches faster.
+    The prefilter deletes every byte that cannot start a bad word; an empty result means no match.
+    Replacement strings are built once per word length instead of once per match.
+    """
+    pattern = r'\b' + _trie_pattern(words) + r'\b'
+    first_bytes = {ord(c) for word in words for c in (word[0].lower(), word[0].upper())}
+    return (
+        re.compile(pattern, re.IGNORECASE),
+        re.compile(pattern),
+        bytes(b for b in range(256) if b not in first_bytes),
+        {n: '*' * n for n in {len(word) for word in words}},
+    )
+
+_CENSOR_WORDS = frozenset(BAD_WORDS)
+
 def censor_message(msg):
     """Censors bad words in the message using regular expressions for word boundaries."""
-    censored_msg = msg
-    for word in BAD_WORDS:
-        pattern = r'\b' + re.escape(word) + r'\b'
-        replacement = '*' * len(word)
-        censored_msg = re.sub(pattern, replacement, censored_msg, flags=re.IGNORECASE)
-    return censored_msg
+    censor_re, censor_re_lower, non_first_bytes, stars = _compile_censor(_CENSOR_WORDS)
+    # IGNORECASE also folds some non-ASCII letters (e.g. 'ſ' -> 's'), so those skip the fast paths
+    if not msg.isascii():
+        return censor_re.sub(lambda m: stars[m.end() - m.start()], msg)
+    if not msg.encode('ascii').translate(None, non_first_bytes):
+        return msg
+
+    # ASCII lowercasing keeps every index intact, so spans map straight back onto msg
+    pieces = []
+    last = 0
+    for m in censor_re_lower.finditer(msg.lower()):
+        start, end = m.span()
+        pieces.append(msg[last:start])
+        pieces.append(stars[end - start])
+        last = end
+    if not pieces:
+        return msg
+    pieces.append(msg[last:])
+    return ''.join(pieces)
+
+# --- Outbound Payload Pool ---
+def _get_msg_dict():
+    return _msg_pool.pop() if _msg_pool else {}
+
+def _put_msg_dict(d):
+    d.clear()
+    if len(_msg_pool) < MSG_POOL_SIZE:
+        _msg_pool.append(d)
 
 # --- Broadcast Functions ---
 def broadcast_user_count():
-    with alias_lock:
+    """Schedules one 'user_count' broadcast; connects/disconnects within the delay window share it."""
+    global user_count_timer
+    with user_count_timer_lock:
+        if user_count_timer is None:
+            user_count_timer = eventlet.spawn_after(USER_COUNT_BROADCAST_DELAY_SECONDS, _flush_user_count)
+
+def _flush_user_count():
+    global user_count_timer
+    with user_count_timer_lock:
+        user_count_timer = None
+    with sid_lock:
         count = len(user_aliases)
     socketio.emit('user_count', {'count': count})
-    print(f"[STATUS] Broadcasting user count: {count}")
+    log.debug("[STATUS] Broadcasting user count: %d", count)
 
 def broadcast_typists():
+    """Schedules one 'typists' broadcast; calls within the delay window share it."""
+    global typists_timer
+    with typists_timer_lock:
+        if typists_timer is None:
+            typists_timer = eventlet.spawn_after(TYPISTS_BROADCAST_DELAY_SECONDS, _flush_typists)
+
+def _flush_typists():
+    global typists_timer
+    # Clear the timer before snapshotting so later changes schedule a fresh broadcast
+    with typists_timer_lock:
+        typists_timer = None
     with typing_lock:
-        typists_list = list(typing_users)
+        typing_sids = tuple(typing_users)
+    with sid_lock:
+        typists_list = [user_aliases[s] for s in typing_sids if s in user_aliases]
     socketio.emit('typists', {'typists': typists_list})
 
 # --- Identity Persistence Helper ---
+def _evict_expired_sessions(now):
+    """Drops expired alias reservations from the front. Caller must hold sessions_lock."""
+    while temporary_sessions:
+        alias, expiry_time = next(iter(temporary_sessions.items()))
+        if expiry_time >= now:
+            break
+        temporary_sessions.popitem(last=False)
+
 def get_alias_or_reconnect(sid, provided_alias=None):
-    global current_anon_id
-    if provided_alias and provided_alias in temporary_sessions:
-        expiry_time = temporary_sessions[provided_alias]
-        if datetime.now() < expiry_time:
-            print(f"[RECONNECT] {provided_alias} reused alias (SID: {sid}).")
-            del temporary_sessions[provided_alias]
-            user_aliases[sid] = provided_alias
-            return provided_alias, True
-
-    current_anon_id += 1
-    new_alias = f"Anon-User-{current_anon_id}"
-    user_aliases[sid] = new_alias
-    print(f"[NEW CONNECTION] {new_alias} assigned (SID: {sid}).")
-    return new_alias, False
+    is_reconnect = False
+    with sessions_lock:
+        now = time.monotonic()
+        _evict_expired_sessions(now)
+        if provided_alias and provided_alias in temporary_sessions:
+            expiry_time = temporary_sessions[provided_alias]
+            if now < expiry_time:
+                del temporary_sessions[provided_alias]
+                is_reconnect = True
+
+    if is_reconnect:
+        alias = provided_alias
+        log.debug("[RECONNECT] %s reused alias (SID: %s).", alias, sid)
+    else:
+        alias = f"Anon-User-{next(anon_id_counter)}"
+        log.debug("[NEW CONNECTION] %s assigned (SID: %s).", alias, sid)
+
+    with sid_lock:
+        user_aliases[sid] = alias
+    return alias, is_reconnect
 
 # --- Background Purge Logic ---
 def purge_messages_loop():
     """Runs a continuous loop as a background task to purge old messages."""
-    global chat_history
-
     while True:
         try:
-            # print(f"[PURGE] Starting message purge check at {datetime.now().strftime('%H:%M:%S')}")
-
-            cutoff_time = time.time() - HISTORY_RETENTION_SECONDS
-
-            with history_lock:
-                new_history = [
-                    msg for msg in chat_history if msg['timestamp'] > cutoff_time
-                ] 
-                removed_count = len(chat_history) - len(new_history)
-                if removed_count > 0:
-                    chat_history = new_history
-                    print(f"[PURGE] Removed {removed_count} old messages. History size: {len(chat_history)}")
-                # else:
-                #     print(f"[PURGE] No messages removed. History size: {len(chat_history)}")
+            # log.debug("[PURGE] Starting message purge check at %s", time.strftime('%H:%M:%S'))
+
+            # Unlocked emptiness check: an idle server skips the lock entirely
+            if chat_history:
+                cutoff_time = time.monotonic() - HISTORY_RETENTION_SECONDS
+
+                # Messages are appended in timestamp order, so expired ones sit at the front
+                removed_count = 0
+                with history_lock:
+                    while chat_history and chat_history[0].ts <= cutoff_time:
+                        chat_history.popleft()
+                        removed_count += 1
+                    if removed_count > 0:
+                        log.debug("[PURGE] Removed %d old messages. History size: %d", removed_count, len(chat_history))
+                    # else:
+                    #     log.debug("[PURGE] No messages removed. History size: %d", len(chat_history))
             
             # Use eventlet.sleep to yield control
             eventlet.sleep(PURGE_INTERVAL_SECONDS) 
 
-        except Exception as e:
-            print(f"[PURGE ERROR] An exception occurred in the purge loop: {e}")
+        except Exception:
+            log.exception("[PURGE ERROR] An exception occurred in the purge loop")
             eventlet.sleep(PURGE_INTERVAL_SECONDS) 
 
 # --- ROUTES (Serving the UI) ---
@@ -123,26 +262,25 @@ def handle_connect(auth):
 
     # ⭐️ FIX: Start the background task only on the first connection to this worker
     if not background_task_started:
-        print("[SETUP] Starting background message purge task (First Connection).")
+        log.debug("[SETUP] Starting background message purge task (First Connection).")
         # Use eventlet.spawn as a more direct method when eventlet is patched
         eventlet.spawn(purge_messages_loop) 
         background_task_started = True
 
     provided_alias = auth.get('alias') if auth else None
     
-    with alias_lock:
-        alias, is_reconnect = get_alias_or_reconnect(sid, provided_alias)
+    alias, is_reconnect = get_alias_or_reconnect(sid, provided_alias)
     
     broadcast_user_count()
     broadcast_typists() 
     emit('set_alias', {'alias': alias})
 
+    # Only the pointer copy happens under the lock; build the payload after releasing it
     with history_lock:
-        history_to_send = [
-            {'alias': msg['alias'], 'msg': msg['msg']} 
-            for msg in chat_history
-        ]
-        emit('history', {'messages': history_to_send})
+        history_snapshot = tuple(chat_history)
+    # Sent as [alias, msg] pairs; orjson writes each cached fragment out as-is
+    history_to_send = [orjson.Fragment(m.json) for m in history_snapshot]
+    emit('history', {'messages': history_to_send})
 
     if is_reconnect:
         join_msg = f'{alias} reconnected.'
@@ -155,16 +293,19 @@ def handle_connect(auth):
 @socketio.on('disconnect')
 def handle_disconnect():
     sid = request.sid
-    with alias_lock:
+    with sid_lock:
         alias = user_aliases.pop(sid, 'Unknown User')
-        if alias != 'Unknown User':
-            expiry_time = datetime.now() + timedelta(seconds=PERSISTENCE_TIMEOUT_SECONDS)
-            temporary_sessions[alias] = expiry_time
-            print(f"[DISCONNECT] {alias} reserved until {expiry_time.strftime('%H:%M:%S')}")
+    if alias != 'Unknown User':
+        now = time.monotonic()
+        with sessions_lock:
+            _evict_expired_sessions(now)
+            temporary_sessions[alias] = now + PERSISTENCE_TIMEOUT_SECONDS
+            temporary_sessions.move_to_end(alias)
+        log.debug("[DISCONNECT] %s reserved for %ds", alias, PERSISTENCE_TIMEOUT_SECONDS)
 
     with typing_lock:
-        if alias in typing_users:
-            typing_users.remove(alias)
+        if sid in typing_users:
+            typing_users.remove(sid)
             broadcast_typists() 
 
     broadcast_user_count()
@@ -173,48 +314,52 @@ def handle_disconnect():
 
 @socketio.on('send_message')
 def handle_send_message(data):
+    msg = data.get('msg')
+    # Reject empty sends before touching any lock
+    if not (msg and msg.strip()):
+        return
+
     sid = request.sid
     alias = user_aliases.get(sid, 'Unknown Anon')
-    msg = data.get('msg')
-    
     with typing_lock:
-        if alias in typing_users:
-            typing_users.remove(alias)
+        typing_count = len(typing_users)
+        typing_users.discard(sid)
+        if len(typing_users) != typing_count:
             broadcast_typists()
 
-    if msg and msg.strip():
-        censored_msg = censor_message(msg)
-        message_data = {
-            'alias': alias, 
-            'msg': censored_msg, 
-            'timestamp': time.time() 
-        }
-        with history_lock:
-            chat_history.append(message_data)
-        emit('message', {'alias': alias, 'msg': censored_msg}, broadcast=True)
-    else:
-        print(f"[DEBUG] Message was empty or whitespace from {alias}.")
+    censored_msg = censor_message(msg)
+    cached_json = orjson.dumps([alias, censored_msg])
+    with history_lock:
+        chat_history.append(Msg(alias, censored_msg, time.monotonic(), cached_json))
+    payload = _get_msg_dict()
+    payload['alias'] = alias
+    payload['msg'] = censored_msg
+    try:
+        # The packet is encoded before emit returns, so the dict can go straight back
+        emit('message', payload, broadcast=True)
+    finally:
+        _put_msg_dict(payload)
 
 @socketio.on('is_typing')
 def handle_is_typing():
     sid = request.sid
-    alias = user_aliases.get(sid, 'Unknown Anon')
     with typing_lock:
-        if alias not in typing_users:
-            typing_users.add(alias)
+        if sid not in typing_users:
+            typing_users.add(sid)
             broadcast_typists()
 
 @socketio.on('not_typing')
 def handle_not_typing():
     sid = request.sid
-    alias = user_aliases.get(sid, 'Unknown Anon')
     with typing_lock:
-        if alias in typing_users:
-            typing_users.remove(alias)
+        if sid in typing_users:
+            typing_users.remove(sid)
             broadcast_typists()
 
 
 if __name__ == '__main__':
     # When running locally via 'python app.py'
     # The purge loop will start via the 'connect' handler on the first local connection.
+    logging.basicConfig(level=logging.INFO)
+    log.setLevel(logging.DEBUG)
     socketio.run(app, debug=True)